@@ -11,7 +11,7 @@ import warnings
 
 class ANN(KerasSmartModel):
     
-    sample_hparams = {
+    sample_hparams = MappingProxyType({
         # General and I/O parameters
         "model_name": "ANN",
         "input_shape": [10],
@@ -51,7 +51,7 @@ class ANN(KerasSmartModel):
         'early_stopping_value': 1.0e-6,
         'other_callbacks': None,
         'custom_schedule': None
-    }
+    })
     
     
     def __init__(self, hparams:dict=None):
@@ -221,15 +221,15 @@ class ANN(KerasSmartModel):
         self._dense_norm_layer_position_vec = self._gen_hparam_vec_for_dense(self._norm_layer_position, 'norm_layer_position')
         self._dense_dropout_vec = self._gen_hparam_vec_for_dense(self._dropout, 'dropout')
         
-        # Initialize sequential model
-        self.net = tf.keras.models.Sequential(name=self._model_name)
+        # Collect the layers of the dense blocks; the network is built from them as a Functional model at the end.
+        blocks = tf.keras.models.Sequential()
         
         # Construct the dense layers
         # in_size = self._input_shape
         for i in range(self._depth):
             # out_size = self._dense_width_vec[i]
             _kwargs = {
-                'model':self.net,
+                'model':blocks,
                 'output_size':self._dense_width_vec[i],
                 'activation':self._dense_activation_vec[i],
                 'activation_params':self._dense_activation_params_vec[i],
@@ -240,35 +240,35 @@ class ANN(KerasSmartModel):
                 'kernel_regularizer':self.make_regularizer(),
                 'dense_params':self._dense_params_vec[i],
             }
-            if i==0 and self._input_shape is not None:
-                _kwargs.update({'input_shape':self._input_shape})
             add_dense_block(**_kwargs)
             # in_size = out_size
+        layers = list(blocks.layers)
         
         # Output layer
-        if self._include_output_layer:
-            _kwargs = {'units':self._output_size, 'kernel_regularizer':self.make_regularizer()}
-            if self._output_dense_params:
-                _kwargs.update(self._output_dense_params)
-            self.net.add(tf.keras.layers.Dense(**_kwargs))
-            if self._output_activation:
-                if isinstance(self._output_activation, str):
-                    if self._output_activation.lower() == self._output_activation:
-                        self.net.add(tf.keras.layers.Activation(self._output_activation))
+        with self._float32_output_scope():
+            if self._include_output_layer:
+                _kwargs = {'units':self._output_size, 'kernel_regularizer':self.make_regularizer()}
+                if self._output_dense_params:
+                    _kwargs.update(self._output_dense_params)
+                layers.append(tf.keras.layers.Dense(**_kwargs))
+                if self._output_activation:
+                    if isinstance(self._output_activation, str):
+                        if self._output_activation.lower() == self._output_activation:
+                            layers.append(tf.keras.layers.Activation(self._output_activation))
+                        elif self._output_activation_params:
+                            layers.append(getattr(tf.keras.layers, self._output_activation)(**self._output_activation_params))
+                        else:
+                            layers.append(getattr(tf.keras.layers, self._output_activation)())
                     elif self._output_activation_params:
-                        self.net.add(getattr(tf.keras.layers, self._output_activation)(**self._output_activation_params))
+                        layers.append(self._output_activation(**self._output_activation_params))
                     else:
-                        self.net.add(getattr(tf.keras.layers, self._output_activation)())
-                elif self._output_activation_params:
-                    self.net.add(self._output_activation(**self._output_activation_params))
-                else:
-                    self.net.add(self._output_activation())
+                        layers.append(self._output_activation())
+        
+        # Build the Functional model; this also casts the outputs to float32 under a mixed precision policy.
+        self._build_from_layers(layers, name=self._model_name)
 
     def _gen_hparam_vec_for_dense(self, hparam, hparam_name, **kwargs):
         return generate_array_for_hparam(hparam, self._depth, hparam_name=hparam_name, count_if_not_list_name='depth', **kwargs)
-        
-    def call(self, x, **kwargs):
-        return self.net(x, **kwargs)
 
 
 
@@ -11,7 +11,7 @@ else:
 
 class Conv_Network(KerasSmartModel):
     
-    sample_hparams = {
+    sample_hparams = MappingProxyType({
         "model_name": "Conv_Network",
         # I/O shapes (without the batch dimension)
         "input_shape": [28, 28, 3],
@@ -75,7 +75,7 @@ class Conv_Network(KerasSmartModel):
         'early_stopping_value':1.0e-6,
         'other_callbacks': None,
         'custom_schedule': None,
-    }
+    })
     
     
     def __init__(self, hparams:dict=None):
@@ -411,29 +411,33 @@ class Conv_Network(KerasSmartModel):
                     self.size_list.append([out_size])
         
         # Construct output layer
-        if self._include_output_layer:
-            # Output hyperparameters
-            self._output_dense_params = hparams.get("output_dense_params")
-            self._output_activation = hparams.get("output_activation")
-            self._output_activation_params = hparams.get("output_activation_params")
+        with self._float32_output_scope():
+            if self._include_output_layer:
+                # Output hyperparameters
+                self._output_dense_params = hparams.get("output_dense_params")
+                self._output_activation = hparams.get("output_activation")
+                self._output_activation_params = hparams.get("output_activation_params")
         
-            # Output layer
-            _kwargs = {'units':self._output_shape[-1], 'kernel_regularizer':self.make_regularizer()}
-            if self._output_dense_params:
-                _kwargs.update(self._output_dense_params)
-            self.net.add(tf.keras.layers.Dense(**_kwargs))
-            if self._output_activation:
-                if isinstance(self._output_activation, str):
-                    if self._output_activation.lower() == self._output_activation:
-                        self.net.add(tf.keras.layers.Activation(self._output_activation))
+                # Output layer
+                _kwargs = {'units':self._output_shape[-1], 'kernel_regularizer':self.make_regularizer()}
+                if self._output_dense_params:
+                    _kwargs.update(self._output_dense_params)
+                self.net.add(tf.keras.layers.Dense(**_kwargs))
+                if self._output_activation:
+                    if isinstance(self._output_activation, str):
+                        if self._output_activation.lower() == self._output_activation:
+                            self.net.add(tf.keras.layers.Activation(self._output_activation))
+                        elif self._output_activation_params:
+                            self.net.add(getattr(tf.keras.layers, self._output_activation)(**self._output_activation_params))
+                        else:
+                            self.net.add(getattr(tf.keras.layers, self._output_activation)())
                     elif self._output_activation_params:
-                        self.net.add(getattr(tf.keras.layers, self._output_activation)(**self._output_activation_params))
+                        self.net.add(self._output_activation(**self._output_activation_params))
                     else:
-                        self.net.add(getattr(tf.keras.layers, self._output_activation)())
-                elif self._output_activation_params:
-                    self.net.add(self._output_activation(**self._output_activation_params))
-                else:
-                    self.net.add(self._output_activation())
+                        self.net.add(self._output_activation())
+            elif self._mixed_precision:
+                # No output layer, but the outputs are still cast to float32
+                self.net.add(tf.keras.layers.Activation('linear'))
 
     
     def _gen_hparam_vec_for_conv(self, hparam, hparam_name, **kwargs):
@@ -441,9 +445,6 @@ class Conv_Network(KerasSmartModel):
     
     def _gen_hparam_vec_for_dense(self, hparam, hparam_name, **kwargs):
         return generate_array_for_hparam(hparam, self._dense_depth, hparam_name=hparam_name, count_if_not_list_name='dense_depth', **kwargs)
-    
-    def call(self, inputs, **kwargs):
-        return self.net(inputs, **kwargs)
 
 
 
@@ -7,9 +7,96 @@ else:
     sys.path.append(parent_dir)
     from utils import *
 
+from collections import namedtuple
+from contextlib import contextmanager
+from types import MappingProxyType
+
+# `reduce_retracing` replaced `experimental_relax_shapes` in TF 2.9
+_RELAX_SHAPES_KWARGS = {'reduce_retracing': True} if tuple(int(v) for v in tf.__version__.split('.')[:2]) >= (2, 9) \
+    else {'experimental_relax_shapes': True}
+
+# Training-related hyperparameters read by `KerasSmartModel.__init__`, with their defaults if missing.
+_HPARAM_DEFAULTS = {
+    'batch_size': None, 'loss_function': None, 'loss_function_params': None, 'metrics': None, 'metrics_params': None,
+    'optimizer': None, 'optimizer_params': None, 'early_stopping_patience_epochs': None, 'learning_rate': None,
+    'exponential_decay_rate': None, 'validation_data': None, 'epochs': None, 'l2_reg': None, 'l1_reg': None,
+    'gc_every_epoch': False, 'gc_every_n_epochs': None, 'checkpoint_path': None, 'async_checkpoint': False,
+    'early_stopping_monitor': None, 'early_stopping_mode': None, 'early_stopping_value': None, 'other_callbacks': None,
+    'custom_schedule': None, 'mixed_precision': None, 'jit_compile': True, 'steps_per_execution': None, 'grad_accum_steps': None,
+    'activation_checkpointing': 'none', 'warmup_on_compile': False}
+_HParams = namedtuple("_HParams", _HPARAM_DEFAULTS.keys(), defaults=_HPARAM_DEFAULTS.values())
+_HPARAM_FIELDS = frozenset(_HPARAM_DEFAULTS)
+
+# Layers that must not be recomputed during backpropagation, because they are random or update state in the forward pass
+_NON_RECOMPUTABLE_LAYERS = (tf.keras.layers.Dropout, tf.keras.layers.GaussianNoise, tf.keras.layers.GaussianDropout, 
+                            tf.keras.layers.AlphaDropout, tf.keras.layers.BatchNormalization)
+
+class _CheckpointedSegment(tf.keras.layers.Layer):
+    """Contiguous run of layers whose intermediate activations are recomputed during backpropagation instead of being stored.
+    Only the input of the segment is kept in memory; the layers inside it are run again under `tf.recompute_grad` in the backward pass.
+    Loading a saved network containing segments requires `custom_objects={'_CheckpointedSegment': _CheckpointedSegment}`.
+    """
+    def __init__(self, layers:list, **kwargs):
+        super(_CheckpointedSegment, self).__init__(**kwargs)
+        self.segment_layers = list(layers)
+    def build(self, input_shape):
+        # Create the variables up front, since they must not be created inside `tf.recompute_grad`.
+        shape = tf.TensorShape(input_shape)
+        for layer in self.segment_layers:
+            if not layer.built:
+                layer.build(shape)
+            shape = layer.compute_output_shape(shape)
+        super(_CheckpointedSegment, self).build(input_shape)
+    def call(self, inputs):
+        def forward(x):
+            for layer in self.segment_layers:
+                x = layer(x)
+            return x
+        return tf.recompute_grad(forward)(inputs)
+    def compute_output_shape(self, input_shape):
+        shape = tf.TensorShape(input_shape)
+        for layer in self.segment_layers:
+            shape = layer.compute_output_shape(shape)
+        return shape
+    def get_config(self):
+        config = super(_CheckpointedSegment, self).get_config()
+        config['layers'] = [tf.keras.layers.serialize(layer) for layer in self.segment_layers]
+        return config
+    @classmethod
+    def from_config(cls, config, custom_objects=None):
+        config = dict(config)
+        layers = [tf.keras.layers.deserialize(layer, custom_objects=custom_objects) for layer in config.pop('layers')]
+        return cls(layers, **config)
+
+
+def _default_mixed_precision_policy():
+    """Return "mixed_bfloat16" if a TPU or an Ampere (compute capability 8.0) or newer GPU is available, otherwise None."""
+    if tf.config.list_physical_devices('TPU'):
+        return "mixed_bfloat16"
+    if tf.test.is_built_with_cuda():
+        for gpu in tf.config.list_physical_devices('GPU'):
+            try:
+                cc = tf.config.experimental.get_device_details(gpu).get('compute_capability')
+            except Exception:
+                cc = None
+            if cc and tuple(cc) >= (8, 0):
+                return "mixed_bfloat16"
+    return None
+
+
 class KerasSmartModel(tf.keras.models.Model):
     
-    sample_hparams = {
+    # Plain Python attributes set from the hyperparameters. Slotted names are class attributes, which the attribute tracking of Keras
+    # skips, so they are assigned normally. Keras-tracked objects (`net`, callbacks, history, etc.) are deliberately left out, because
+    # Keras and tf.Module discover them through the instance `__dict__`.
+    __slots__ = ('hparams', '_batch_size', '_loss_function', '_loss_function_params', '_metrics_params', '_optimizer_params',
+                 '_early_stopping_patience_epochs', '_learning_rate', '_exponential_decay_rate', '_validation_data', '_epochs',
+                 '_l2_reg', '_l1_reg', '_gc_every_epoch', '_gc_every_n_epochs', '_chkpt', '_async_checkpoint',
+                 'early_stopping_monitor', 'early_stopping_mode', 'early_stopping_value', '_mixed_precision', '_jit_compile_hp',
+                 '_steps_per_execution_hp', '_grad_accum_steps', '_activation_checkpointing', '_built_from_layers', '_warmup_on_compile',
+                 '_compiled_signature')
+    
+    sample_hparams = MappingProxyType({
         'model_name': 'KerasSmartModel',
         'l2_reg': 0.0001,
         'l1_reg': None,
@@ -26,12 +113,21 @@ class KerasSmartModel(tf.keras.models.Model):
         'optimizer': 'Adam',
         'optimizer_params': None,
         'checkpoint_path':None,
+        'async_checkpoint': False,
         'early_stopping_monitor':'loss',
         'early_stopping_mode':'min',
         'early_stopping_value':1.0e-6,
         'other_callbacks': None,
-        'custom_schedule': None
-    }
+        'gc_every_epoch': False,
+        'gc_every_n_epochs': 1,
+        'custom_schedule': None,
+        'mixed_precision': None,
+        'jit_compile': True,
+        'steps_per_execution': 1,
+        'grad_accum_steps': 1,
+        'activation_checkpointing': 'none',
+        'warmup_on_compile': False
+    })
     
     def __init__(self, hparams:dict=None):
         """
@@ -62,11 +158,35 @@ class KerasSmartModel(tf.keras.models.Model):
             - `metrics_params` (list): (list of) additional kwargs parameters of the metrics constructors, if any. Ignored for every metric that is a lower-case name string.
                 If this entry is a single dicitonary rather than a list, it will be broadcast to all metrics in the metrics list.
             - `checkpoint_path` (str): Path to the directory where checkpoints will be saved at every epoch.
+            - `async_checkpoint` (bool): Write checkpoints in a background thread using `AsyncModelCheckpoint`. Defaults to False.
+                The weights are then saved as a numpy `.npz` archive, to be loaded with `load_async_checkpoint()`, so `checkpoint_path` must be
+                a file path rather than a directory.
             - `early_stopping_monitor` (str): Monitor whose critical value will cause early stopping. Default is 'loss', but 'val_loss' is typically used.
             - `early_stopping_mode` (str): Mode of the parameter whose critical value will be used for early stopping. Deafults to 'min' for any error. 'max' is for accuracy, etc.
             - `early_stopping_value` (float): Value of the monitor at which point training will stop becasue the critical value has been reached.
             - `other_callbacks` (list): List of other callbacks to be used during training. Defaults to None.
+            - `gc_every_epoch` (bool): Run Python garbage collection at the end of every epoch. Defaults to False.
+            - `gc_every_n_epochs` (int): If `gc_every_epoch` is True, only collect garbage every this many epochs. Defaults to 1.
             - `custom_schedule` (schedule): Custom learning rate schedule inheriting from `tf.keras.optimizers.schedules.LearningRateSchedule`. Defaults to None.
+            - `mixed_precision` (str): Keras mixed precision policy, e.g. "mixed_float16", "mixed_bfloat16" or "float32". It is set as the global
+                Keras policy, and stays set after the model is built. None leaves the current global policy untouched (float32 unless it has
+                been changed with `tf.keras.mixed_precision.set_global_policy()`).
+                With "mixed_float16" the optimizer is wrapped in a `LossScaleOptimizer` to avoid gradient underflow. "mixed_bfloat16" needs no loss scaling.
+                "auto" uses "mixed_bfloat16" on TPUs and on GPUs with compute capability 8.0 or higher, and float32 otherwise.
+            - `jit_compile` (bool): Compile the training step with XLA. Defaults to True. If XLA cannot compile an op of the model, a warning
+                is issued and training falls back to `jit_compile=False`. Ignored on TF versions whose `compile()` has no `jit_compile`.
+            - `steps_per_execution` (int): Number of minibatches run inside a single compiled `tf.function` call. Defaults to None (i.e. 1).
+            - `grad_accum_steps` (int): Number of minibatches whose gradients are accumulated before every weight update, emulating a
+                batch of `batch_size * grad_accum_steps` samples without its memory cost. Defaults to None (i.e. 1).
+                Requires an optimizer that accepts the `gradient_accumulation_steps` argument.
+            - `activation_checkpointing` (str): "none" or "every_n". With "every_n", `_build_from_layers()` splits the network into segments of
+                about sqrt(N) layers, stores only the activations at the segment boundaries, and recomputes the rest during backpropagation.
+                This costs roughly 33% more computation, but saves a lot of activation memory, allowing larger batches. Defaults to "none".
+                It only applies to networks built with `_build_from_layers()`, such as `ANN`.
+            - `warmup_on_compile` (bool): Trace the training function on an all-zeros batch at the end of `compile_model()`, so that graph
+                tracing happens there rather than in the first real training step. No training step is run, so the weights of the network
+                and the state of the optimizer are left untouched. This only saves a trace if the training data of `fit_model()` has floating
+                point inputs and targets (integer targets for sparse losses). Defaults to False.
 
         ### Returns
 
@@ -75,71 +195,177 @@ class KerasSmartModel(tf.keras.models.Model):
         
         ### Notes:
         
+        - `sample_hparams` is a read-only mapping. Use `dict(Model.sample_hparams)` to get a modifiable copy.
         - `self.batch_input_shape` attribute must be set in the `__init__` method.
         - `self.batch_output_shape` attribute must be set in the `__init__` method.
-        - `self._callbacks` is a list of callbacks sent to the training method of Keras. It already includes garbage collection.
+        - `self._callbacks` is a tuple of callbacks sent to the training method of Keras. It is None until `_build_callbacks()` is called
+          by the fit methods, so models that are only used for prediction or evaluation never construct any callbacks.
+          It includes garbage collection only if `gc_every_epoch` is True.
         - `self._es` is an EarlyStopping instance of Keras, if specified, otherwise None.
+        - If both `early_stopping_patience_epochs` and `early_stopping_monitor` are given, `self._es` and `self._es_crit` are the same
+          `FusedEarlyStopCallback` instance, which checks both conditions in a single callback.
         - `self._chkpt` is the hyperparameter `checkpoint_path` from the input dictionary, if it exists, otherwise None.
-        - `self._chk` is a ModelCheckpoint instance sent to the training function of Keras, if specified, otherwise None.
+        - `self._chk` is a ModelCheckpoint (or AsyncModelCheckpoint) instance sent to the training function of Keras, if specified, otherwise None.
         - `self._es_crit` is an EarlyStopAtCriteria instance that stops the training if 'val_loss' for instance, reaches a certain value.
+        - `call()` forwards its inputs to `self.net.call()` inside a `tf.function`, so child classes normally do not need to override it.
+          Assigning a new network to `self.net` also replaces that `tf.function`.
         - `self.net` **MUST** always exist so that Keras2Cpp can serialize the layers that it understands.
           `self.net` is always used as the model within this module, that contains the network itself. It is typically a Sequential or Functional model built in the `__init__` 
           method.
+        - Instead of adding layers to a Sequential `self.net` one by one, child classes can build the list of their layers and call
+          `self._build_from_layers(layers)` once, after `self.batch_input_shape` is set. This builds `self.net` as a Functional model
+          with a known input shape, skipping the incremental shape inference of `Sequential.add()`.
+        - `compile_model()` is skipped if the model has already been compiled with the same batch size, learning rate, optimizer, and
+          number of samples. Call `invalidate_compile()` after changing the architecture of `self.net` to force a re-compilation.
+        - The global Keras policy is set to `mixed_precision` (if it is not None) before `self.net` is constructed, so every layer
+          built afterwards in the child class follows it. The policy is left set, so it also applies to Keras models built afterwards. With a mixed policy, those layers compute in half precision. Child classes **MUST** then force the final output layer (e.g. the output `Dense`
+          or `Softmax` activation) to `dtype="float32"` for numerical stability of the loss, e.g. by building it inside
+          `with self._float32_output_scope():`. `_build_from_layers()` does this automatically.
         """
         super(KerasSmartModel, self).__init__()
-        if not hparams: hparams = self.sample_hparams
+        # The model always gets its own copy of the hyperparameters that it is free to modify, e.g. when the training history is added
+        # to it, and that can be serialized (`sample_hparams` is read-only). Lists are copied too, so they are not shared with the defaults.
+        hparams = {k:(list(v) if isinstance(v, list) else v) for k,v in (hparams if hparams else self.sample_hparams).items()}
         self.hparams = hparams
-        self._batch_size = int(hparams["batch_size"]) if hparams.get("batch_size") else 32
-        self._loss_function = hparams.get("loss_function")
-        self._loss_function_params = hparams.get("loss_function_params")
-        self._metrics = hparams.get("metrics")
-        self._metrics_params = hparams.get("metrics_params")
-        self._optimizer = hparams.get("optimizer")
-        self._optimizer_params = hparams.get("optimizer_params")
-        self._early_stopping_patience_epochs = hparams.get("early_stopping_patience_epochs")
-        self._learning_rate = hparams.get("learning_rate")
-        self._exponential_decay_rate = hparams.get("exponential_decay_rate")
-        self._validation_data = hparams.get("validation_data")
-        self._epochs = hparams.get("epochs")
-        self._l2_reg = hparams.get("l2_reg") if hparams.get("l2_reg") else None
-        self._l1_reg = hparams.get("l1_reg") if hparams.get("l1_reg") else None
+        h = _HParams(**{k:v for k,v in hparams.items() if k in _HPARAM_FIELDS})
+        self._batch_size = int(h.batch_size) if h.batch_size else 32
+        self._loss_function = h.loss_function
+        self._loss_function_params = h.loss_function_params
+        self._metrics = h.metrics
+        self._metrics_params = h.metrics_params
+        self._optimizer = h.optimizer
+        self._optimizer_params = h.optimizer_params
+        self._early_stopping_patience_epochs = h.early_stopping_patience_epochs
+        self._learning_rate = h.learning_rate
+        self._exponential_decay_rate = h.exponential_decay_rate
+        self._validation_data = h.validation_data
+        self._epochs = h.epochs
+        self._l2_reg = h.l2_reg if h.l2_reg else None
+        self._l1_reg = h.l1_reg if h.l1_reg else None
         self.history = None
         self.batch_input_shape = (self._batch_size, 1)
         self.batch_output_shape = (self._batch_size, 1)
-        self._callbacks = [GarbageCollectionCallback()]
-        self._es = tf.keras.callbacks.EarlyStopping(monitor='val_loss' if hparams.get('validation_data') is not None else 'loss', 
-                                                    mode="min", patience=self._early_stopping_patience_epochs) if self._early_stopping_patience_epochs else None
-        if self._es:
-            self._callbacks.append(self._es)
-        self._chkpt = hparams.get("checkpoint_path")
-        if self._chkpt:
-            self._chk = tf.keras.callbacks.ModelCheckpoint(self._chkpt, monitor=('val_loss' if hparams.get('validation_data') is not None else 'loss'), 
-                                                           verbose=0, save_best_only=True, mode='min')
-        else:
-            self._chk = None
-        if self._chk:
-            self._callbacks.append(self._chk)
-        self.early_stopping_monitor = hparams.get("early_stopping_monitor")
-        self.early_stopping_mode = hparams.get("early_stopping_mode")
-        self.early_stopping_value = hparams.get("early_stopping_value")
-        if self.early_stopping_monitor:
-            self._es_crit = EarlyStopAtCriteria(monitor=self.early_stopping_monitor, mode=self.early_stopping_mode, value=self.early_stopping_value)
-            self._callbacks.append(self._es_crit)
-        else:
-            self._es_crit = None
-        self._other_callbacks = hparams.get("other_callbacks")
+        self._gc_every_epoch = h.gc_every_epoch
+        self._gc_every_n_epochs = h.gc_every_n_epochs or 1
+        self._chkpt = h.checkpoint_path
+        self._async_checkpoint = h.async_checkpoint
+        self.early_stopping_monitor = h.early_stopping_monitor
+        self.early_stopping_mode = h.early_stopping_mode
+        self.early_stopping_value = h.early_stopping_value
+        self._other_callbacks = h.other_callbacks
         if self._other_callbacks is not None:
             assert isinstance(self._other_callbacks, list), "other_callbacks must be a list of callbacks"
-            self._callbacks.extend(self._other_callbacks)
-        self._custom_schedule = hparams.get("custom_schedule")
+        # Callbacks are only constructed when the model is first fit, see `_build_callbacks()`.
+        self._callbacks = None
+        self._es = None
+        self._chk = None
+        self._es_crit = None
+        self._custom_schedule = h.custom_schedule
+        _mixed_precision = h.mixed_precision
+        if _mixed_precision is not None:
+            # Only an explicit policy is set, otherwise a policy set by the user through `tf.keras.mixed_precision` is respected.
+            _mixed_precision = _default_mixed_precision_policy() if _mixed_precision == "auto" else _mixed_precision
+            tf.keras.mixed_precision.set_global_policy(_mixed_precision or "float32")
+        policy = tf.keras.mixed_precision.global_policy().name
+        self._mixed_precision = policy if policy.startswith("mixed") else None
+        self._jit_compile_hp = h.jit_compile
+        self._steps_per_execution_hp = h.steps_per_execution
+        self._grad_accum_steps = h.grad_accum_steps
+        self._activation_checkpointing = h.activation_checkpointing or 'none'
+        assert self._activation_checkpointing in ('none', 'every_n'), "activation_checkpointing must be 'none' or 'every_n'."
+        self._built_from_layers = False
+        self._warmup_on_compile = h.warmup_on_compile
+        self._compiled_signature = None
+        # The `tf.function` calling `self.net` is not a slot, and is kept out of the attribute tracking of Keras explicitly.
+        object.__setattr__(self, '_net_call', None)
         
     
         # Construct an empty Sequential model
         self.net = tf.keras.models.Sequential()
     
     
+    @property
+    def net(self):
+        return self._net
+    
+    @net.setter
+    def net(self, value):
+        self._net = value
+        # A new `tf.function` per network, so that graphs traced for a previous network are never reused.
+        # It calls the inner network's `call` directly; `Layer.__call__` has already been run once by this wrapper model.
+        object.__setattr__(self, '_net_call', tf.function(value.call, **_RELAX_SHAPES_KWARGS))
+    
+    
     def call(self, x, *args, **kwargs):
-        return self.net(x, *args, **kwargs)
+        return self._net_call(x, *args, **kwargs)
+    
+    
+    def _build_from_layers(self, layers:list, name:str=None):
+        """Build `self.net` as a Functional model by applying a list of layers in order to an input of shape `self.batch_input_shape`.
+        The batch dimension is left free, so that the network can still be evaluated on batches of any size.
+        If a mixed precision policy is in use, the outputs are cast back to float32 for numerical stability of the loss.
+        If `activation_checkpointing` is "every_n", the layers are grouped into checkpointed segments with `_wrap_checkpointed()`.
+
+        Args:
+            layers (list): Ordered list of Keras layers.
+            name (str, optional): Name of the model. Defaults to None, in which case the `model_name` hyperparameter is used.
+
+        Returns:
+            The Functional model, which is also stored in `self.net`.
+        """
+        if self._activation_checkpointing == 'every_n':
+            layers = self._wrap_checkpointed(layers)
+        self._built_from_layers = True
+        inputs = tf.keras.Input(shape=tuple(self.batch_input_shape[1:]))
+        x = inputs
+        for layer in layers:
+            x = layer(x)
+        if self._mixed_precision:
+            x = tf.keras.layers.Activation('linear', dtype='float32')(x)
+        self.net = tf.keras.Model(inputs, x, name=(name if name else self.hparams.get("model_name")))
+        return self.net
+    
+    @contextmanager
+    def _float32_output_scope(self):
+        """Context in which layers are built in float32 regardless of the mixed precision policy. Child classes build their output
+        layers inside it, so that the outputs of the network and the loss are computed in float32.
+        """
+        previous = tf.keras.mixed_precision.global_policy()
+        tf.keras.mixed_precision.set_global_policy("float32")
+        try:
+            yield
+        finally:
+            tf.keras.mixed_precision.set_global_policy(previous)
+    
+    def _wrap_checkpointed(self, layers:list):
+        """Group a list of layers into contiguous segments of about sqrt(N) layers, each recomputed as a whole under `tf.recompute_grad`,
+        so that only the activations at the segment boundaries are stored (sqrt-N schedule). Layers with randomness or forward-pass state
+        updates (Dropout, BatchNormalization) must not be recomputed, so they are left outside of the segments and split them.
+
+        Args:
+            layers (list): Ordered list of Keras layers.
+
+        Returns:
+            list: Ordered list of layers and `_CheckpointedSegment` layers, computing the same function as `layers`.
+        """
+        segment_length = max(2, int(round(math.sqrt(len(layers)))))
+        wrapped, segment = [], []
+        def flush():
+            if len(segment) > 1:
+                wrapped.append(_CheckpointedSegment(segment))
+            else:
+                wrapped.extend(segment)
+            segment.clear()
+        for layer in layers:
+            if isinstance(layer, _NON_RECOMPUTABLE_LAYERS):
+                flush()
+                wrapped.append(layer)
+                continue
+            segment.append(layer)
+            if len(segment) == segment_length:
+                flush()
+        flush()
+        return wrapped
     
     # def build(self):
     #     super().build(input_shape=self.batch_input_shape) 
@@ -148,13 +374,46 @@ class KerasSmartModel(tf.keras.models.Model):
         return self.net.summary()
         
     def get_config(self):
-        config = super(KerasSmartModel, self).get_config()
-        config['hparams'] = self.hparams
-        return config
+        # The hyperparameters fully determine the model, so nothing else is needed to rebuild it.
+        return {'hparams': self.hparams}
     
     @classmethod
     def from_config(cls, config):
-        return cls(config['hparams'])
+        return cls(config.get('hparams'))
+    
+    
+    def _build_callbacks(self):
+        """Construct the training callbacks from the constructor hyperparameters, once.
+
+        Returns:
+            tuple: Callbacks passed to the Keras fit function.
+        """
+        if self._callbacks is not None:
+            return self._callbacks
+        callbacks = []
+        if self._gc_every_epoch:
+            callbacks.append(GarbageCollectionCallback(self._gc_every_n_epochs))
+        monitor = 'val_loss' if self._validation_data is not None else 'loss'
+        if self._early_stopping_patience_epochs and self.early_stopping_monitor:
+            # Both patience and criteria are checked by a single callback
+            self._es = self._es_crit = FusedEarlyStopCallback(
+                monitor_patience=monitor, patience=self._early_stopping_patience_epochs, monitor_crit=self.early_stopping_monitor, 
+                mode=self.early_stopping_mode, crit_value=self.early_stopping_value)
+            callbacks.append(self._es)
+        elif self._early_stopping_patience_epochs:
+            self._es = tf.keras.callbacks.EarlyStopping(monitor=monitor, mode="min", patience=self._early_stopping_patience_epochs)
+            callbacks.append(self._es)
+        elif self.early_stopping_monitor:
+            self._es_crit = EarlyStopAtCriteria(monitor=self.early_stopping_monitor, mode=self.early_stopping_mode, value=self.early_stopping_value)
+            callbacks.append(self._es_crit)
+        if self._chkpt:
+            _checkpoint_class = AsyncModelCheckpoint if self._async_checkpoint else tf.keras.callbacks.ModelCheckpoint
+            self._chk = _checkpoint_class(self._chkpt, monitor=monitor, verbose=0, save_best_only=True, mode='min')
+            callbacks.append(self._chk)
+        if self._other_callbacks is not None:
+            callbacks.extend(self._other_callbacks)
+        self._callbacks = tuple(callbacks)
+        return self._callbacks
     
     
     def compile_model(self, num_samples=None):
@@ -163,15 +422,61 @@ class KerasSmartModel(tf.keras.models.Model):
         Args:
             num_samples (int, optional): Number of samples. Defaults to None.
         """
+        signature = (id(self.net), self._batch_size, self._learning_rate, self._optimizer, num_samples)
+        if signature == self._compiled_signature:
+            return
+        if self._activation_checkpointing != 'none' and not self._built_from_layers:
+            warnings.warn("activation_checkpointing is ignored, because the network was not built with `_build_from_layers()`.", UserWarning)
+        schedule = self._custom_schedule
+        if not schedule and self._exponential_decay_rate:
+            # Decay once per epoch. The number of steps is fixed here, and `staircase` keeps the decay piecewise-constant.
+            # Floor division matches the number of full batches fed by `make_keras_dataset()`.
+            steps_per_epoch = max(1, int(num_samples)//self._batch_size) if num_samples else 1
+            schedule = tf.keras.optimizers.schedules.ExponentialDecay(
+                initial_learning_rate=self._learning_rate, decay_steps=steps_per_epoch, 
+                decay_rate=self._exponential_decay_rate, staircase=True)
         compile_keras_model(self.net, _batchsize=self._batch_size, _learnrate=self._learning_rate, _optimizer=self._optimizer, 
                             _loss=self._loss_function, _metrics=self._metrics, _optimizer_params=self._optimizer_params,
                             _loss_params=self._loss_function_params, _metrics_params=self._metrics_params, 
-                            _exponential_decay_rate=self._exponential_decay_rate, num_samples=num_samples, custom_schedule=self._custom_schedule)
+                            _exponential_decay_rate=self._exponential_decay_rate, num_samples=num_samples, custom_schedule=schedule,
+                            mixed_precision=self._mixed_precision, jit_compile=self._jit_compile_hp, 
+                            steps_per_execution=self._steps_per_execution_hp, grad_accum_steps=self._grad_accum_steps)
+        # Create the training `tf.function` now; it is only traced on its first call (or by the warm-up below).
+        self.net.make_train_function()
+        if self._warmup_on_compile:
+            self._warm_up()
+        self._compiled_signature = signature
+    
+    
+    def _warm_up(self):
+        """Trace the training function of the network on an all-zeros batch of shape `self.batch_input_shape`, without running it.
+        The batch goes through `make_keras_dataset()` like the numpy arrays given to `fit_model()`, with floatx inputs and targets,
+        or integer targets for sparse losses, so the traced function is the one that the first training step uses.
+        Tracing creates the optimizer's slot variables, but applies no update, so the weights, the optimizer state and the loss scale
+        of mixed precision training are left untouched.
+        """
+        x = np.zeros(self.batch_input_shape, dtype=tf.keras.backend.floatx())
+        if isinstance(self._loss_function, str) and 'sparse' in self._loss_function.lower():
+            y = np.zeros(self.batch_output_shape[:-1], dtype=np.int64)
+        else:
+            y = np.zeros(self.batch_output_shape, dtype=tf.keras.backend.floatx())
+        dataset = make_keras_dataset(x, y, self._batch_size, shuffle=False)
+        try:
+            self.net.train_function.get_concrete_function(iter(dataset))
+        except Exception as e:
+            warnings.warn("Warm-up tracing failed, the first training step will be slower:\n%s"%str(e), UserWarning)
+    
+    
+    def invalidate_compile(self):
+        """Force the next call to `compile_model()` to re-compile the network, e.g. after its architecture has changed."""
+        self._compiled_signature = None
     
     
     def fit_model(self, x_train, y_train, x_val=None, y_val=None, verbose:int=1, **kwargs):
         """Fit (train) the Keras Smart Model to training data using pure numpy arrays.
         NOTE: Use `fit_model_with_dataset` if you use tf.data.Dataset objects rather than pure numpy arrays.
+        NOTE: The arrays are internally wrapped in a shuffled and prefetched `tf.data.Dataset`, unless `validation_split`,
+        `sample_weight` or `class_weight` are given in the keyword arguments, in which case they are passed to Keras as they are.
 
         Args:
             x_train (array): Training inputs
@@ -179,14 +484,33 @@ class KerasSmartModel(tf.keras.models.Model):
             x_val (array, optional): Validation inputs. Defaults to None.
             y_val (array, optional): Validation target outputs. Defaults to None.
             verbose (int, optional): Verbosity passed to the Keras Fit function. Defaults to 1.
+            map_fn (callable, optional): Function mapped in parallel over every training sample of the internal dataset. Defaults to None.
+            dataset_options (tf.data.Options, optional): Options of the internal datasets, overriding the defaults of `make_keras_dataset()`.
+                Defaults to None.
             
             Other keyword arguments are passed to the Keras fit function.
 
         Returns:
             History object returned by the Keras fit function
         """
+        map_fn = kwargs.pop('map_fn', None)
+        dataset_options = kwargs.pop('dataset_options', None)
+        if isinstance(x_train, np.ndarray) and isinstance(y_train, np.ndarray) and \
+            not any(k in kwargs for k in ('validation_split', 'sample_weight', 'class_weight')):
+            shuffle = kwargs.pop('shuffle', True)
+            def make_datasets(batch_size):
+                # Called again with a halved batch size if training fails, e.g. by running out of memory.
+                train_dataset = make_keras_dataset(x_train, y_train, batch_size, shuffle=shuffle, map_fn=map_fn, options=dataset_options)
+                val_dataset = make_keras_dataset(x_val, y_val, batch_size, shuffle=False, drop_remainder=False, options=dataset_options) \
+                    if x_val is not None and y_val is not None else None
+                return train_dataset, val_dataset
+            self.history = fit_keras_model_with_dataset(self.net, *make_datasets(self._batch_size), 
+                self._batch_size, self._epochs, self._build_callbacks(), verbose, make_datasets=make_datasets, **kwargs)
+            return self.history
+        if map_fn is not None or dataset_options is not None:
+            warnings.warn("map_fn and dataset_options are ignored, because the data is passed to Keras without an internal dataset.", UserWarning)
         self.history = fit_keras_model(self.net, x_train, y_train, x_val, y_val, 
-            self._batch_size, self._epochs, self._callbacks, verbose, **kwargs)
+            self._batch_size, self._epochs, self._build_callbacks(), verbose, **kwargs)
         return self.history
     
     
@@ -205,7 +529,7 @@ class KerasSmartModel(tf.keras.models.Model):
             History object returned by the Keras fit function
         """
         self.history = fit_keras_model_with_dataset(self.net, train_dataset, val_dataset, 
-            self._batch_size, self._epochs, self._callbacks, verbose, **kwargs)
+            self._batch_size, self._epochs, self._build_callbacks(), verbose, **kwargs)
         return self.history
 
     
@@ -229,7 +553,8 @@ class KerasSmartModel(tf.keras.models.Model):
               The path can have no extension, in which case a SavedModel format will be used, or it can have a .h5 extension, in which case a HDF5 format will be used, or it can have a .keras extension, in which case the new Keras format will be used.
             - `save_hparams_to` (str, optional): Save hyperparameters to path. Defaults to None. Path does not need to exist.
             - `export_to_file` (str, optional): Save Keras model in .model file using keras2cpp for later use in C++. Defaults to None.
-              Path does not need to exist.
+              Path does not need to exist. It can also be a tuple `(path, "int8")`, in which case an int8-quantized TFLite model is written
+              to a `.tflite` file beside `path` instead, calibrated on the training inputs.
             - `save_kwargs` (dict, optional): Additional kwargs to pass to the `tf.keras.Model.save()` function. Defaults to None.
             
             Other keyword arguments are passed to the Keras `tf.keras.Model.fit()` function.
@@ -250,7 +575,7 @@ class KerasSmartModel(tf.keras.models.Model):
                 hparams=self.hparams,
                 **save_kwargs)
         if export_to_file:
-            export_keras_model(self.net, export_to_file)
+            self._export(export_to_file, representative_data=x_train)
     
     
     
@@ -267,7 +592,8 @@ class KerasSmartModel(tf.keras.models.Model):
               The path can have no extension, in which case a SavedModel format will be used, or it can have a .h5 extension, in which case a HDF5 format will be used, or it can have a .keras extension, in which case the new Keras format will be used.
             - `save_hparams_to` (str, optional): Save hyperparameters to path. Defaults to None. Path does not need to exist.
             - `export_to_file` (str, optional): Save Keras model in .model file using keras2cpp for later use in C++. Defaults to None.
-              Path does not need to exist.
+              Path does not need to exist. It can also be a tuple `(path, "int8")`, in which case an int8-quantized TFLite model is written
+              to a `.tflite` file beside `path` instead, calibrated on the training inputs.
             - `save_kwargs` (dict, optional): Additional kwargs to pass to the `tf.keras.Model.save()` function. Defaults to None.
             
             Other keyword arguments are passed to the Keras `tf.keras.Model.fit()` function.
@@ -299,7 +625,7 @@ class KerasSmartModel(tf.keras.models.Model):
                 hparams=self.hparams,
                 **save_kwargs)
         if export_to_file:
-            export_keras_model(self.net, export_to_file)
+            self._export(export_to_file, representative_data=train_dataset)
 
 
 
@@ -344,7 +670,7 @@ class KerasSmartModel(tf.keras.models.Model):
             return None 
     
     
-    def save_model(self, save_model_to:str=None, save_hparams_to:str=None, export_to_file:str=None, **kwargs):
+    def save_model(self, save_model_to:str=None, save_hparams_to:str=None, export_to_file:str=None, representative_data=None, **kwargs):
         """Save the model to file.
 
         ### Args:
@@ -352,7 +678,9 @@ class KerasSmartModel(tf.keras.models.Model):
               The path can have no extension, in which case a SavedModel format will be used, or it can have a .h5 extension, in which case a HDF5 format will be used, or it can have a .keras extension, in which case the new Keras format will be used.
             - `save_hparams_to` (str, optional): Save hyperparameters to path. Defaults to None. Path does not need to exist.
             - `export_to_file` (str, optional): Save Keras model in .model file using keras2cpp for later use in C++. Defaults to None.
-              Path does not need to exist.
+              Path does not need to exist. It can also be a tuple `(path, "int8")`, in which case an int8-quantized TFLite model is written
+              to a `.tflite` file beside `path` instead.
+            - `representative_data` (array|tf.data.Dataset, optional): Inputs used to calibrate int8 quantization. Required for int8 export.
             - **kwargs: Additional kwargs to pass to the `tf.keras.Model.save()` function. Defaults to None.
         """
         save_keras_model(
@@ -363,15 +691,42 @@ class KerasSmartModel(tf.keras.models.Model):
             hparams=self.hparams,
             **kwargs)
         if export_to_file:
-            export_keras_model(self.net, export_to_file)
+            self._export(export_to_file, representative_data=representative_data)
     
     
-    def export_model(self, export_to_file:str):
+    def export_model(self, export_to_file:str, representative_data=None):
         """Export the model to file.
 
         ### Args:
             - `export_to_file` (str): Save Keras model in .model file using keras2cpp for later use in C++. Path does not need to exist.
+              It can also be a tuple `(path, "int8")`, in which case an int8-quantized TFLite model is written to a `.tflite` file beside `path`.
+            - `representative_data` (array|tf.data.Dataset, optional): Inputs used to calibrate int8 quantization. Required for int8 export.
+        """
+        self._export(export_to_file, representative_data=representative_data)
+    
+    
+    def _export(self, export_to_file, representative_data=None):
+        if isinstance(export_to_file, (list, tuple)):
+            path, fmt = export_to_file
+            assert fmt == "int8", "The only supported export format other than keras2cpp is 'int8'."
+            assert representative_data is not None, "int8 export requires representative data to calibrate the quantization."
+            export_keras_model_int8(self._unwrapped_net(), path, representative_data)
+        else:
+            export_keras_model(self._unwrapped_net(), export_to_file)
+    
+    
+    def _unwrapped_net(self):
+        """Return the network to export. A network built with `_build_from_layers()` is returned as an equivalent Sequential model of its
+        plain layers, including those inside checkpointed segments, sharing their weights. Exporters such as Keras2Cpp only understand
+        plain layers in sequence.
         """
-        export_keras_model(self.net, export_to_file)
+        if not self._built_from_layers:
+            return self.net
+        layers = [tf.keras.Input(shape=tuple(self.batch_input_shape[1:]))]
+        for layer in self.net.layers:
+            if isinstance(layer, tf.keras.layers.InputLayer):
+                continue
+            layers.extend(layer.segment_layers if isinstance(layer, _CheckpointedSegment) else [layer])
+        return tf.keras.models.Sequential(layers, name=self.net.name)
         
 
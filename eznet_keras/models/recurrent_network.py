@@ -16,7 +16,7 @@ import warnings
 
 class Recurrent_Network(KerasSmartModel):
     
-    sample_hparams = {
+    sample_hparams = MappingProxyType({
         # General and I/O parameters
         'model_name': 'Recurrent_Network',
         'in_features': 10,
@@ -71,7 +71,7 @@ class Recurrent_Network(KerasSmartModel):
         'early_stopping_value':1.0e-6,
         'other_callbacks': None,
         'custom_schedule': None
-    }
+    })
     
     def __init__(self, hparams:dict=None):
         """Sequence to Dense network with RNN for time-series classification, regression, and forecasting, as well as NLP applications.
@@ -345,35 +345,36 @@ class Recurrent_Network(KerasSmartModel):
                 # in_size = out_size
         
         # Output layer
-        if self._include_output_layer:
-            _kwargs = {'units':self._output_width, 'kernel_regularizer':self.make_regularizer()}
-            if self._output_dense_params is not None:
-                _kwargs.update(self._output_dense_params)
-            self.net.add(tf.keras.layers.Dense(**_kwargs))
-            if self._output_activation:
-                if isinstance(self._output_activation, str):
-                    if self._output_activation.lower() == self._output_activation:
-                        self.net.add(tf.keras.layers.Activation(self._output_activation))
+        with self._float32_output_scope():
+            if self._include_output_layer:
+                _kwargs = {'units':self._output_width, 'kernel_regularizer':self.make_regularizer()}
+                if self._output_dense_params is not None:
+                    _kwargs.update(self._output_dense_params)
+                self.net.add(tf.keras.layers.Dense(**_kwargs))
+                if self._output_activation:
+                    if isinstance(self._output_activation, str):
+                        if self._output_activation.lower() == self._output_activation:
+                            self.net.add(tf.keras.layers.Activation(self._output_activation))
+                        elif self._output_activation_params:
+                            self.net.add(getattr(tf.keras.layers, self._output_activation)(**self._output_activation_params))
+                        else:
+                            self.net.add(getattr(tf.keras.layers, self._output_activation)())
                     elif self._output_activation_params:
-                        self.net.add(getattr(tf.keras.layers, self._output_activation)(**self._output_activation_params))
+                        self.net.add(self._output_activation(**self._output_activation_params))
                     else:
-                        self.net.add(getattr(tf.keras.layers, self._output_activation)())
-                elif self._output_activation_params:
-                    self.net.add(self._output_activation(**self._output_activation_params))
-                else:
-                    self.net.add(self._output_activation())
+                        self.net.add(self._output_activation())
+            elif self._mixed_precision:
+                # No output layer, but the outputs are still cast to float32
+                self.net.add(tf.keras.layers.Activation('linear'))
             
-        # Permute if necessary
-        if self._permute_output:
-            self.net.add(tf.keras.layers.Permute((2,1)))
+            # Permute if necessary
+            if self._permute_output:
+                self.net.add(tf.keras.layers.Permute((2,1)))
             
             
         
     def _gen_hparam_vec_for_dense(self, hparam, hparam_name, **kwargs):
         return generate_array_for_hparam(hparam, self._dense_depth, hparam_name=hparam_name, count_if_not_list_name='dense_depth', **kwargs)
-    
-    def call(self, x, *args, **kwargs):
-        return self.net(x, *args, **kwargs)
 
 
 
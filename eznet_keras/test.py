@@ -54,9 +54,151 @@ def test_recurrent_network():
 def test_ann_network():
     test_keras_model_class(ANN)
 
+def test_make_keras_dataset():
+    x = np.arange(100, dtype=np.float32).reshape(50,2)
+    y = np.arange(50, dtype=np.float32).reshape(50,1)
+    # The incomplete last batch is dropped
+    ds = make_keras_dataset(x, y, 16)
+    assert len(list(ds)) == 50//16, "drop_remainder should drop the last incomplete batch."
+    assert all(xb.shape[0] == 16 for xb, _ in ds)
+    ds = make_keras_dataset(x, y, 16, drop_remainder=False)
+    assert len(list(ds)) == math.ceil(50/16)
+    # Datasets smaller than one batch still yield that one batch
+    ds = make_keras_dataset(x[:10], y[:10], 16)
+    batches = list(ds)
+    assert len(batches) == 1 and batches[0][0].shape[0] == 10, "Datasets smaller than a batch must not be dropped entirely."
+    # The validation set keeps its order across epochs
+    ds = make_keras_dataset(x, y, 16, shuffle=False, drop_remainder=False)
+    for _ in range(2):
+        assert np.array_equal(np.concatenate([yb.numpy() for _, yb in ds]), y), "Validation set must not be shuffled."
+    # Floating point arrays are cast to floatx, integer labels are kept as they are
+    ds = make_keras_dataset(x.astype(np.float64), np.arange(50).reshape(50,1), 16)
+    assert ds.element_spec[0].dtype == tf.keras.backend.floatx() and ds.element_spec[1].dtype.is_integer
+    print("make_keras_dataset passed.")
 
 
 
+
+def _stop_epoch(callbacks, logs_sequence):
+    # Run the callbacks on a fixed sequence of epoch logs, and return the epoch at which training stops (None if it does not).
+    class _Model:
+        stop_training = False
+    model = _Model()
+    for cb in callbacks:
+        cb.set_model(model)
+        cb.on_train_begin()
+    for epoch, logs in enumerate(logs_sequence):
+        for cb in callbacks:
+            cb.on_epoch_end(epoch, dict(logs))
+        if model.stop_training:
+            return epoch
+    return None
+
+def test_fused_early_stop_callback():
+    loss = [1.0, 0.8, 0.9, 0.85, 0.95, 0.7, 0.05, 0.6]
+    acc = [0.5, 0.6, 0.7, 0.8, 0.95, 0.9, 0.5, 0.99]
+    logs_sequence = [{'val_loss': l, 'val_accuracy': a} for l, a in zip(loss, acc)]
+    cases = [
+        # (patience, criteria monitor, criteria mode, criteria value)
+        (3, 'val_loss', 'min', 0.001),      # Patience is reached first
+        (10, 'val_loss', 'min', 0.1),       # Criteria is reached first
+        (10, 'val_accuracy', 'max', 0.9),   # Max-mode criteria on another monitor
+        (2, 'val_accuracy', 'max', 0.999),  # Patience is reached, criteria never is
+    ]
+    for patience, monitor, mode, value in cases:
+        old = _stop_epoch([tf.keras.callbacks.EarlyStopping(monitor='val_loss', mode='min', patience=patience), 
+                           EarlyStopAtCriteria(monitor=monitor, mode=mode, value=value)], logs_sequence)
+        fused = _stop_epoch([FusedEarlyStopCallback(monitor_patience='val_loss', patience=patience, monitor_crit=monitor, 
+                                                    mode=mode, crit_value=value)], logs_sequence)
+        assert old == fused, "Stopped at epoch %s instead of %s for case %s."%(str(fused), str(old), str((patience, monitor, mode, value)))
+        print("Case %s: both stopped at epoch %s."%(str((patience, monitor, mode, value)), str(old)))
+    print("FusedEarlyStopCallback passed.")
+
+
+def test_export_keras_model_int8():
+    model = tf.keras.models.Sequential([tf.keras.Input(shape=(8,)), tf.keras.layers.Dense(16, activation='relu'), tf.keras.layers.Dense(2)])
+    x = np.random.rand(20, 8).astype(np.float32)
+    for representative_data in (x, tf.constant(x), x.tolist(), make_keras_dataset(x, x[:,:2], 4)):
+        tflite_path = export_keras_model_int8(model, "test_int8_model.model", representative_data, num_samples=10)
+        interpreter = tf.lite.Interpreter(model_path=tflite_path)
+        interpreter.allocate_tensors()
+        assert any(t['dtype'] == np.int8 for t in interpreter.get_tensor_details()), "The TFLite model is not int8-quantized."
+        interpreter.set_tensor(interpreter.get_input_details()[0]['index'], x[:1])
+        interpreter.invoke()
+        assert interpreter.get_tensor(interpreter.get_output_details()[0]['index']).shape == (1, 2)
+    print("export_keras_model_int8 passed.")
+
+
+def test_activation_checkpointing():
+    def make_layers():
+        return [tf.keras.layers.Dense(16, activation='tanh') for _ in range(4)] + [tf.keras.layers.BatchNormalization()] + \
+            [tf.keras.layers.Dense(16, activation='tanh') for _ in range(4)] + [tf.keras.layers.Dense(2)]
+    models = []
+    for mode in ('none', 'every_n'):
+        hparams = dict(KerasSmartModel.sample_hparams)
+        hparams['activation_checkpointing'] = mode
+        model = KerasSmartModel(hparams)
+        model.batch_input_shape = (8, 6)
+        model._build_from_layers(make_layers())
+        models.append(model)
+    plain, checkpointed = models
+    segments = [layer for layer in checkpointed.net.layers if type(layer).__name__ == '_CheckpointedSegment']
+    assert segments, "No checkpointed segment was built."
+    checkpointed.net.set_weights(plain.net.get_weights())
+    x = np.random.rand(8, 6).astype(np.float32)
+    outputs, grads = [], []
+    for model in models:
+        with tf.GradientTape() as tape:
+            y = model.net(x, training=True)
+            loss = tf.reduce_sum(tf.square(y))
+        outputs.append(y.numpy())
+        grads.append([g.numpy() for g in tape.gradient(loss, model.net.trainable_variables)])
+    assert np.allclose(outputs[0], outputs[1], atol=1e-5), "Checkpointing changed the outputs."
+    assert len(grads[0]) == len(grads[1]) and all(np.allclose(g0, g1, atol=1e-5) for g0, g1 in zip(*grads)), \
+        "Checkpointing changed the gradients."
+    # The plain layers can be exported, and the segments can be serialized
+    assert np.allclose(checkpointed._unwrapped_net()(x).numpy(), plain.net(x).numpy(), atol=1e-5)
+    net = tf.keras.Model.from_config(checkpointed.net.get_config(), custom_objects={'_CheckpointedSegment': type(segments[0])})
+    net.set_weights(checkpointed.net.get_weights())
+    assert np.allclose(net(x).numpy(), plain.net(x).numpy(), atol=1e-5)
+    print("Activation checkpointing passed.")
+
+
+def test_ann_functional():
+    hparams = dict(ANN.sample_hparams)
+    hparams.update({'epochs': 1, 'activation_checkpointing': 'every_n', 'early_stopping_patience_epochs': None})
+    model = ANN(hparams)
+    assert not isinstance(model.net, tf.keras.models.Sequential), "ANN should be built through `_build_from_layers()`."
+    (x, y) = generate_sample_batch(model)
+    weights = [w.copy() for w in model.net.get_weights()]
+    model.train_model(x, y, verbose=0, save_model_to="test_ann_functional.h5", export_to_file="test_ann_functional.model")
+    assert any(not np.array_equal(w0, w1) for w0, w1 in zip(weights, model.net.get_weights())), "Training did not update the weights."
+    print("Functional ANN passed.")
+
+
+def test_async_model_checkpoint():
+    import tempfile
+    def make_model():
+        model = tf.keras.models.Sequential([tf.keras.Input(shape=(4,)), tf.keras.layers.Dense(8, activation='relu'), tf.keras.layers.Dense(1)])
+        model.compile(optimizer='adam', loss='mse')
+        return model
+    x = np.random.rand(32, 4).astype(np.float32)
+    y = np.random.rand(32, 1).astype(np.float32)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            AsyncModelCheckpoint(tmpdir)
+            raise AssertionError("A directory should be rejected as the checkpoint path.")
+        except ValueError:
+            pass
+        path = os.path.join(tmpdir, "checkpoint.npz")
+        model = make_model()
+        model.fit(x, y, batch_size=8, epochs=2, verbose=0, callbacks=[AsyncModelCheckpoint(path, monitor='loss')])
+        restored = load_async_checkpoint(make_model(), path)
+        assert all(np.array_equal(w0, w1) for w0, w1 in zip(model.get_weights(), restored.get_weights())), \
+            "Restored weights differ from the saved ones."
+    print("AsyncModelCheckpoint passed.")
+
+
 if __name__ == '__main__':
     
     # testcalc_image_size()
@@ -70,5 +212,12 @@ if __name__ == '__main__':
     # test_recurrent_network()
     # test_ann_network()
     
+    # test_make_keras_dataset()
+    # test_fused_early_stop_callback()
+    # test_export_keras_model_int8()
+    # test_activation_checkpointing()
+    # test_ann_functional()
+    # test_async_model_checkpoint()
+    
     
     pass
\ No newline at end of file
@@ -8,7 +8,10 @@ if __name__ == "eznet_keras.utils":
 else:
     from keras2cpp import export_model
 import os
+import io
+import inspect
 import warnings
+import concurrent.futures
 from pathlib import Path
 import math
 import json
@@ -71,7 +74,9 @@ def plot_keras_model_history(history:dict, metrics:list=['loss'], fig_title:str=
 
 
 def compile_keras_model(model, _batchsize:int, _learnrate:float, _optimizer:str, _loss:str, _metrics:list, 
-                          _optimizer_params:dict=None, _loss_params:dict=None, _metrics_params:list=None, _exponential_decay_rate:float=None, num_samples:int=None, custom_schedule=None):
+                          _optimizer_params:dict=None, _loss_params:dict=None, _metrics_params:list=None, _exponential_decay_rate:float=None, num_samples:int=None, custom_schedule=None,
+                          mixed_precision:str=None, jit_compile:bool=None, steps_per_execution:int=None,
+                          grad_accum_steps:int=None):
     if custom_schedule:
         lr = custom_schedule
     elif _exponential_decay_rate:
@@ -84,13 +89,21 @@ def compile_keras_model(model, _batchsize:int, _learnrate:float, _optimizer:str,
     
     _opt_module = getattr(tf.keras.optimizers, _optimizer) if isinstance(_optimizer, str) else _optimizer
     
-    if _optimizer_params:
-        optparam = _optimizer_params
+    optparam = dict(_optimizer_params) if _optimizer_params else {}
+    if grad_accum_steps and int(grad_accum_steps) > 1:
+        optparam['gradient_accumulation_steps'] = int(grad_accum_steps)
+    try:
         # opt = optdict_keras[_optimizer](learning_rate=lr, **optparam)
         opt = _opt_module(learning_rate=lr, **optparam)
-    else:
-        # opt = optdict_keras[_optimizer](learning_rate=lr)
-        opt = _opt_module(learning_rate=lr)
+    except TypeError as e:
+        if 'gradient_accumulation_steps' in optparam:
+            raise ValueError("Gradient accumulation requires an optimizer that accepts `gradient_accumulation_steps`, "
+                             "such as the built-in optimizers of Keras 3.") from e
+        raise e
+    
+    if mixed_precision == 'mixed_float16':
+        # Scale the loss to avoid underflow of float16 gradients
+        opt = tf.keras.mixed_precision.LossScaleOptimizer(opt)
     
     if isinstance(_loss, str):
         if _loss.lower()==_loss: # Put it as is
@@ -136,11 +149,35 @@ def compile_keras_model(model, _batchsize:int, _learnrate:float, _optimizer:str,
         _metrics_list.append(metr)
     
     
-    model.compile(optimizer=opt, loss=_lossfunc, metrics=_metrics_list)
+    # Only pass the graph-compilation options that were asked for and that `compile()` accepts, so older TF versions keep working.
+    _compile_params = inspect.signature(model.compile).parameters
+    _compile_kwargs = {}
+    if jit_compile is not None and 'jit_compile' in _compile_params:
+        _compile_kwargs['jit_compile'] = jit_compile
+    if steps_per_execution and 'steps_per_execution' in _compile_params:
+        _compile_kwargs['steps_per_execution'] = int(steps_per_execution)
+    model.compile(optimizer=opt, loss=_lossfunc, metrics=_metrics_list, run_eagerly=False, **_compile_kwargs)
     
 
 
 
+def _is_xla_compile_error(model, e):
+    return bool(getattr(model, 'jit_compile', False)) and \
+        isinstance(e, (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError)) and 'XLA' in str(e)
+
+
+def _disable_jit_compile(model, e):
+    """Turn XLA compilation off for a compiled model, after it failed to compile an op, so that training can be retried."""
+    warnings.warn("XLA could not compile the model, falling back to jit_compile=False:\n%s"%str(e), UserWarning)
+    try:
+        model.jit_compile = False
+    except AttributeError: # Read-only property before Keras 2.9
+        model._jit_compile = False
+    model.train_function = None
+    model.test_function = None
+    model.predict_function = None
+
+
 def fit_keras_model(model, x_train, y_train, x_val=None, y_val=None, 
     _batchsize:int=None, _epochs:int=1, _callbacks:list=None, verbose:int=1, **kwargs):
     while True:
@@ -150,6 +187,9 @@ def fit_keras_model(model, x_train, y_train, x_val=None, y_val=None,
                 callbacks=_callbacks, **kwargs)
             break
         except Exception as e:
+            if _is_xla_compile_error(model, e):
+                _disable_jit_compile(model, e)
+                continue
             print(e)
             print(("\nTraining failed with batchsize={}. "+\
                 "Trying again with a lower batchsize...").format(_batchsize))
@@ -159,8 +199,52 @@ def fit_keras_model(model, x_train, y_train, x_val=None, y_val=None,
     return history
 
 
+def _cast_to_floatx(a):
+    a = np.asarray(a)
+    return a.astype(tf.keras.backend.floatx(), copy=False) if np.issubdtype(a.dtype, np.floating) else a
+
+
+def make_keras_dataset(x, y, _batchsize:int, shuffle:bool=True, drop_remainder:bool=True, map_fn=None, options=None):
+    """Build a shuffled, batched and prefetched `tf.data.Dataset` out of numpy arrays.
+    Floating point arrays are cast to `tf.keras.backend.floatx()`, like `tf.keras.Model.fit()` does with numpy arrays.
+
+    ### Args:
+        - `x` (array): Inputs
+        - `y` (array): Target outputs
+        - `_batchsize` (int): Minibatch size
+        - `shuffle` (bool, optional): Reshuffle the samples at every epoch, like `tf.keras.Model.fit()` does. Defaults to True.
+        - `drop_remainder` (bool, optional): Drop the last incomplete batch. Ignored if there are fewer samples than one batch. Defaults to True.
+        - `map_fn` (callable, optional): Function mapped over every `(x, y)` sample before batching, e.g. for augmentation.
+            It runs with `num_parallel_calls=tf.data.AUTOTUNE`. Defaults to None.
+        - `options` (tf.data.Options, optional): Options to use instead of the default ones, which enable map/batch fusion and
+            parallel batching. Defaults to None.
+
+    ### Returns:
+        tf.data.Dataset: The dataset, ready to be fed to `tf.keras.Model.fit()`.
+    """
+    x, y = _cast_to_floatx(x), _cast_to_floatx(y)
+    num_samples = len(x)
+    ds = tf.data.Dataset.from_tensor_slices((x, y))
+    if shuffle:
+        ds = ds.shuffle(num_samples, seed=SEED, reshuffle_each_iteration=True)
+    if map_fn is not None:
+        # Mapping right before batching lets tf.data fuse the two.
+        ds = ds.map(map_fn, num_parallel_calls=tf.data.AUTOTUNE)
+    ds = ds.batch(_batchsize, drop_remainder=(drop_remainder and num_samples >= _batchsize))
+    ds = ds.prefetch(tf.data.AUTOTUNE)
+    if options is None:
+        options = tf.data.Options()
+        # `threading` replaced `experimental_threading` in TF 2.6
+        threading = options.threading if hasattr(options, 'threading') else options.experimental_threading
+        threading.private_threadpool_size = max(1, (os.cpu_count() or 2)//2)
+        options.experimental_optimization.map_and_batch_fusion = True
+        options.experimental_optimization.map_fusion = True
+        options.experimental_optimization.parallel_batch = True
+    return ds.with_options(options)
+
+
 def fit_keras_model_with_dataset(model, train_dataset, val_dataset=None, 
-    _batchsize:int=None, _epochs:int=1, _callbacks:list=None, verbose:int=1, **kwargs):
+    _batchsize:int=None, _epochs:int=1, _callbacks:list=None, verbose:int=1, make_datasets=None, **kwargs):
     while True:
         try:
             history = model.fit(train_dataset, batch_size=_batchsize, epochs=_epochs, 
@@ -168,12 +252,19 @@ def fit_keras_model_with_dataset(model, train_dataset, val_dataset=None,
                 callbacks=_callbacks, **kwargs)
             break
         except Exception as e:
+            if _is_xla_compile_error(model, e):
+                _disable_jit_compile(model, e)
+                continue
+            if make_datasets is None:
+                # The batch size of a prebuilt dataset cannot be lowered here, so retrying would only hide the error.
+                raise
             print(e)
             print(("\nTraining failed with batchsize={}. "+\
                 "Trying again with a lower batchsize...").format(_batchsize))
             _batchsize = _batchsize // 2
             if _batchsize < 2:
-                raise ValueError("Batchsize too small. Training failed.")
+                raise ValueError("Batchsize too small. Training failed.") from e
+            train_dataset, val_dataset = make_datasets(_batchsize)
     return history
 
 
@@ -214,6 +305,46 @@ def export_keras_model(model, path:str):
             raise e2
     
 
+def export_keras_model_int8(model, path:str, representative_data, num_samples:int=100):
+    """Export a Keras model as a full-integer (int8) quantized TensorFlow Lite model, using post-training quantization.
+    The `.tflite` file is written beside `path`, i.e. with the extension of `path` replaced by `.tflite`.
+
+    ### Args:
+        - `model` (tf.keras.Model): The model to export.
+        - `path` (str): Path of the exported model. Path does not need to exist.
+        - `representative_data` (array|tf.data.Dataset): Inputs used to calibrate the quantization ranges. Either an array-like of inputs
+            (numpy array, tensor or list), or a batched dataset of `(x, y)` or `x` elements, such as the training dataset.
+        - `num_samples` (int, optional): Number of samples used for calibration. Defaults to 100.
+
+    ### Returns:
+        str: Path of the `.tflite` file.
+    """
+    def representative_dataset():
+        if isinstance(representative_data, tf.data.Dataset):
+            for batch in representative_data.take(num_samples):
+                x = batch[0] if isinstance(batch, (list, tuple)) else batch
+                yield [tf.cast(x[:1], tf.float32)]
+        else:
+            # Also accepts tensors and (nested) lists of inputs
+            data = np.asarray(representative_data, dtype=np.float32)
+            for i in range(min(num_samples, len(data))):
+                yield [data[i:i+1]]
+    try:
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        tflite_model = converter.convert()
+        tflite_path = make_path(str(Path(path).with_suffix('.tflite')))
+        with open(tflite_path, 'wb') as f:
+            f.write(tflite_model)
+        print("Model exported successfully.")
+        return tflite_path
+    except Exception as e:
+        print("Cannot export Keras model as an int8 TFLite model.")
+        raise e
+    
+
 def test_keras_model_class(model_class, hparams:dict=None, save_and_export:bool=True):
     print("Constructing model...\n")
     model = model_class(hparams)
@@ -240,8 +371,73 @@ def test_keras_model_class(model_class, hparams:dict=None, save_and_export:bool=
 # Perform garbage collection
 import gc
 class GarbageCollectionCallback(tf.keras.callbacks.Callback):
+    def __init__(self, every_n_epochs:int=1):
+        super(GarbageCollectionCallback, self).__init__()
+        self.every_n_epochs = max(1, int(every_n_epochs))
     def on_epoch_end(self, epoch, logs=None):
-        gc.collect()
+        if (epoch + 1) % self.every_n_epochs == 0:
+            gc.collect()
+        
+        
+# Save checkpoints without blocking the training loop
+class AsyncModelCheckpoint(tf.keras.callbacks.Callback):
+    """Checkpoint callback that writes the model weights to disk in a background thread, at the end of every epoch.
+    The model weights are serialized into an in-memory `.npz` buffer on the training thread, and the buffer is written to `filepath`
+    by a single worker thread. At most one write is in flight at any time, and all writes are finished by the end of training.
+    `filepath` may contain formatting options such as `{epoch}` and log entries, like the one of `tf.keras.callbacks.ModelCheckpoint`.
+    Use `load_async_checkpoint(model, path)` to restore the saved weights.
+    """
+    def __init__(self, filepath, monitor='val_loss', verbose=0, save_best_only=False, mode='auto'):
+        super(AsyncModelCheckpoint, self).__init__()
+        self.filepath = str(filepath)
+        if os.path.isdir(self.filepath) or self.filepath.endswith(('/', os.sep)):
+            raise ValueError("AsyncModelCheckpoint writes a single .npz file, so filepath must be a file path, not a directory: %s"%self.filepath)
+        self.monitor = monitor
+        self.verbose = verbose
+        self.save_best_only = save_best_only
+        if mode not in ('auto', 'min', 'max'):
+            raise ValueError("mode must be 'auto', 'min' or 'max', got '%s'."%str(mode))
+        if mode == 'auto':
+            mode = 'max' if 'acc' in monitor or monitor.startswith('fmeasure') else 'min'
+        self.mode = mode
+        self.best = np.inf if mode == 'min' else -np.inf
+        self._executor = None
+        self._future = None
+    def on_train_begin(self, logs=None):
+        if self._executor is not None:
+            # Left over by a training run that raised before `on_train_end()`
+            self._executor.shutdown(wait=True)
+        self._future = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        if self.save_best_only:
+            current = logs.get(self.monitor)
+            if current is None or not (current < self.best if self.mode == 'min' else current > self.best):
+                return
+            self.best = current
+        buffer = io.BytesIO()
+        np.savez(buffer, *self.model.get_weights())
+        path = make_path(self.filepath.format(epoch=epoch + 1, **logs))
+        if self._future is not None:
+            self._future.result()
+        self._future = self._executor.submit(Path(path).write_bytes, buffer.getvalue())
+        if self.verbose > 0:
+            print("\nEpoch %d: saving model weights to %s"%(epoch + 1, path))
+    def on_train_end(self, logs=None):
+        if self._future is not None:
+            self._future.result()
+            self._future = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def load_async_checkpoint(model, path:str):
+    """Load weights saved by `AsyncModelCheckpoint` into a model with the same architecture."""
+    with np.load(path) as f:
+        model.set_weights([f['arr_%d'%i] for i in range(len(f.files))])
+    return model
         
         
 # Deploy early stopping when performance reaches good values
@@ -262,6 +458,38 @@ class EarlyStopAtCriteria(tf.keras.callbacks.Callback):
                 self.model.stop_training = True
         
 
+# Patience-based early stopping and early stopping at criteria, checked in a single callback
+class FusedEarlyStopCallback(tf.keras.callbacks.Callback):
+    def __init__(self, monitor_patience='val_loss', patience=10, monitor_crit='val_loss', mode='min', crit_value=0.001):
+        super(FusedEarlyStopCallback, self).__init__()
+        self.monitor_patience = monitor_patience
+        self.patience = patience
+        self.monitor_crit = monitor_crit
+        self.mode = mode
+        self.crit_value = crit_value
+        self.wait = 0
+        self.best = np.inf
+    def on_train_begin(self, logs=None):
+        self.wait = 0
+        self.best = np.inf
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        current = logs.get(self.monitor_patience)
+        if current is not None:
+            # Patience is always measured on a minimized quantity, like `EarlyStopping(mode='min')`.
+            if current < self.best:
+                self.best = current
+                self.wait = 0
+            else:
+                self.wait += 1
+                if self.wait >= self.patience:
+                    self.model.stop_training = True
+        crit = current if self.monitor_crit == self.monitor_patience else logs.get(self.monitor_crit)
+        if crit is not None and (crit <= self.crit_value if self.mode == 'min' else crit >= self.crit_value):
+            print("Early stopping performance criteria has been reached. Stopping training.")
+            self.model.stop_training = True
+        
+
 # Sampling layer used for variational autoencoders
 class Sampling(tf.keras.layers.Layer):
     """Uses (z_mean, z_log_var) to sample z, the vector encoding a digit."""